@@ -41,20 +41,20 @@ def populate_lexicon():
         origin TEXT,
         source TEXT,
         evidence_text TEXT,
-        updated_at REAL
+        updated_at REAL,
+        etag TEXT
       )
     """)
 
     import time
     now = time.time()
 
-    for lemma, origin, source, evidence in SAMPLE_DATA:
-        con.execute(
-            "INSERT OR REPLACE INTO lexicon VALUES (?,?,?,?,?)",
-            (lemma, origin, source, evidence, now)
+    with con:
+        con.executemany(
+            "INSERT OR REPLACE INTO lexicon(lemma,origin,source,evidence_text,updated_at) VALUES (?,?,?,?,?)",
+            [(lemma, origin, source, evidence, now) for lemma, origin, source, evidence in SAMPLE_DATA]
         )
 
-    con.commit()
     print(f"✓ Added {len(SAMPLE_DATA)} entries to lexicon cache")
 
     # Show what we added
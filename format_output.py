@@ -1,14 +1,21 @@
 #!/usr/bin/env python3
-import json
 import sys
 
-print(f"{'TOKEN':<15} | {'LEMMA':<15} | {'POS':<4} | {'ORIGIN':<20} | {'CONF':<5} | {'SOURCE':<12}")
-print("-" * 95)
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
 
-with open(sys.argv[1]) as f:
+row = "{:<15} | {:<15} | {:<4} | {:<20} | {:<5} | {:<12}".format
+
+lines = [row("TOKEN", "LEMMA", "POS", "ORIGIN", "CONF", "SOURCE"), "-" * 95]
+
+with open(sys.argv[1], "rb") as f:
     for line in f:
-        line = line.strip()
-        if not line:
+        if not line.strip():
             continue
-        d = json.loads(line)
-        print(f"{d['token']:<15} | {d['lemma']:<15} | {d['pos'] or 'N/A':<4} | {d['origin']:<20} | {d['confidence']:<5} | {d['evidence']['source']:<12}")
+        d = loads(line)
+        lines.append(row(d['token'], d['lemma'], d['pos'] or 'N/A', d['origin'], d['confidence'], d['evidence']['source']))
+
+lines.append("")
+sys.stdout.write("\n".join(lines))
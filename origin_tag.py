@@ -20,12 +20,41 @@ Options:
     --min-conf 0.5    Filter low-confidence results
 """
 
-import argparse, json, re, sqlite3, time, os
+import argparse, hashlib, json, re, sqlite3, sys, time, os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 from estnltk import Text
+from estnltk.vabamorf.morf import Vabamorf
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import re2 as _re  # optional google-re2: linear-time DFA matching
+except ImportError:
+    _re = re
+
+try:
+    from orjson import dumps as _json_bytes, loads as _json_loads  # optional, much faster codec
+except ImportError:
+    def _json_bytes(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    _json_loads = json.loads  # accepts the raw response bytes too
+
+__all__ = ["TokenResult", "analyze_text", "init_db", "query_eki", "query_wiktionary", "normalize_origin", "generate_html"]
 
 DB_PATH = Path(".cache_origin.sqlite3")
+FETCH_WORKERS = 16  # concurrent EKI/Wiktionary lookups for uncached lemmas
+MORPH_WORKERS = os.cpu_count() or 1  # processes for morphology of large texts
+MORPH_PARALLEL_MIN = 100_000  # characters; smaller texts are tagged in-process
+# Part of the morph cache file name; bump whenever _morph_tokens output changes
+MORPH_CACHE_VERSION = "vabamorf1"
+UNRESOLVED = "unresolved"  # cached negative result: lookups found nothing
+NEGATIVE_TTL = 30 * 86400  # seconds before an unresolved lemma is retried
+EVIDENCE_MAX = 200  # characters of etymology text kept as evidence
 
 LANG_MAP = {
     r"\b(soome-?ugri|fennougric|uralic|soome)\b": "native_finnic",
@@ -41,39 +70,259 @@ LANG_MAP = {
     r"\b(balti|baltic)\b": "loan:baltic",
     r"\b(soome|finnish)\b": "loan:finnish",
 }
+# Lower-case literal prefix of every LANG_MAP alternative, so that every
+# match starts with one of them; keep in step with LANG_MAP (test_normalize.py)
+_LANG_MARKERS = ("soome", "fennougric", "uralic", "madal", "alamsaksa", "low german", "saksa", "german",
+                 "rootsi", "swedish", "vene", "russian", "ladina", "latin", "prantsuse", "french",
+                 "inglise", "english", "läti", "latvian", "leedu", "lithuanian", "balti", "baltic", "finnish")
+
+_OPEN_GROUP_RE = re.compile(r"(?<!\\)\((?!\?)")
+
+def _fused_lang_pattern(lookahead):
+    """Fuse LANG_MAP into one alternation in which group i+1 is entry i.
+
+    The first-letter lookahead is only added on request, since RE2 has no lookarounds.
+    """
+    entries = [_OPEN_GROUP_RE.sub("(?:", p) for p in LANG_MAP]
+    if not all(p.startswith(r"\b(?:") and p.endswith(r")\b") for p in entries):
+        return "(?i)" + "|".join(f"(?P<g{i}>{p})" for i, p in enumerate(entries))
+    inners = [p[5:-3] for p in entries]
+    branches = "|".join(f"(?P<g{i}>{p})" for i, p in enumerate(inners))
+    initials = {marker[0] for marker in _LANG_MARKERS}
+    if lookahead:
+        return rf"(?i)\b(?=[{''.join(sorted(initials))}])(?:{branches})\b"
+    return rf"(?i)\b(?:{branches})\b"
+
+_LANG_RE = _re.compile(_fused_lang_pattern(lookahead=_re is re))
+_LANG_TAGS = list(LANG_MAP.values())
+# _LANG_MARKERS screen run before _LANG_RE. It pays off for the stdlib
+# engine; RE2 scans faster than the screen itself, so it is skipped there.
+_LANG_SCREEN = _re is re
+_NATIVE_RE = _re.compile(r"(?i)\b(päris?eesti|omakeelne|algupärane)\b")
+# Lower-case substrings one of which every _NATIVE_RE match contains
+_NATIVE_MARKERS = ("päriseesti", "pärieesti", "omakeelne", "algupärane")
+# RE2's \b only knows ASCII word characters, so "vene" would match inside
+# "süvene"; matches are then re-checked against Unicode word characters.
+# A rejected match may hide a shorter or overlapping one that RE2 never
+# reports, so such (rare) texts are rescanned with the stdlib patterns.
+_ASCII_BOUNDARIES = _re is not re
+_LANG_RE_UNICODE = re.compile(_fused_lang_pattern(lookahead=True)) if _ASCII_BOUNDARIES else _LANG_RE
+_NATIVE_RE_UNICODE = re.compile(_NATIVE_RE.pattern) if _ASCII_BOUNDARIES else _NATIVE_RE
+# Lemmas that cannot have an etymology entry (punctuation, numbers, single
+# characters); these are tagged "non-word" without any DB or network lookup.
+_SKIP_RE = re.compile(r"[\W\d_]+|.")
+# Closed-class lemmas (pronouns, conjunctions, common adverbs and
+# adpositions, numerals up to twenty) whose native origin is not in doubt;
+# resolved in-code with confidence 1.0, ahead of any DB or network lookup.
+# Function words that are themselves loans (just, vist, sada, tuhat, ...)
+# are deliberately left out.
+_STOPWORDS = dict.fromkeys("""
+    mina sina tema see too mis kes miski keegi mõni kõik iga ise oma sama
+    muu teine selline niisugune
+    ja ning ega ehk või et sest kui nagu kuni kuid vaid siis
+    ei olema mitte ka ju küll veel juba nüüd siin seal sinna siia
+    kus kuhu kust millal miks kuidas kas alati ikka isegi samuti siiski
+    väga palju vähe ainult
+    üle alla peale pärast enne ees taga all peal juures kaudu vastu ilma
+    läbi koos poolt mööda järel
+    üks kaks kolm neli viis kuus seitse kaheksa üheksa kümme üksteist
+    kaksteist kolmteist neliteist viisteist kuusteist seitseteist
+    kaheksateist üheksateist kakskümmend
+""".split(), "native_finnic")
+# "Etümoloogia" label at the start of a line, behind nothing but markup:
+# a heading (===Etümoloogia===), bold ('''Etümoloogia''':), a definition
+# term (;Etümoloogia) or a template ({{etümoloogia}}, {{-etümoloogia-}}).
+_ETY_LABEL_RE = re.compile(r"^[ \t=';:*#{\[-]*[Ee]tümoloogia", re.MULTILINE)
+# The section body after the label: the label's closing markup is skipped,
+# the text runs to a blank line or to the next heading, term, bold label or
+# line opening with a link or template (categories, interwiki, tables).
+# Applied to a bounded window (see _etymology_section).
+_ETY_RE = re.compile(r"[\s=':}\]-]*(.*?)(?:\n[ \t]*\n|\n(?:=|;|'''|\[\[|\{\{)|\Z)", re.DOTALL)
+_ETY_WINDOW = 4000
+# Wikitext markup reduced to its readable text before normalization;
+# category and interwiki links ([[Kategooria:...]], [[fi:...]]) have none
+_WIKI_META_LINK_RE = re.compile(r"\[\[:?(?:kategooria|category|[a-z]{2,3}(?:-[a-z]+)*):[^\[\]]*\]\]", re.I)
+_WIKI_LINK_RE = re.compile(r"\[\[(?:[^\[\]|]*\|)?([^\[\]]*)\]\]")
+_WIKI_TEMPLATE_RE = re.compile(r"\{\{([^{}]*)\}\}")
+# Language codes in template arguments ({{laen|de|Spiegel}}, {{etyl|de|et}})
+# spelled the way the rendered page and LANG_MAP name the language
+_WIKI_LANG_CODES = {
+    "fiu": "soome-ugri", "urj": "soome-ugri", "urj-fin": "soome", "fi": "soome",
+    "gml": "alamsaksa", "nds": "alamsaksa", "nds-de": "alamsaksa",
+    "de": "saksa", "gmh": "saksa", "goh": "saksa",
+    "sv": "rootsi", "gmq-osw": "rootsi", "ru": "vene", "orv": "vene",
+    "la": "ladina", "fr": "prantsuse", "en": "inglise",
+    "lv": "läti", "lt": "leedu", "bat": "balti",
+}
+_WIKI_MARKUP_RE = re.compile(r"<[^>]*>|'{2,}")
+
+# Lookup endpoints and the static part of their query strings, as tuples so
+# each call only appends the lemma instead of rebuilding a params dict.
+EKI_URL = "https://ekilex.ee/api/etymology"
+SONAVEEB_URL = "https://sonaveeb.ee/api/public/v1/word-search"
+WIKTIONARY_URL = "https://et.wiktionary.org/w/api.php"
+_SONAVEEB_PARAMS = (("datasets", "ety"), ("lang", "est"))
+# Page wikitext rather than prop=extracts: TextExtracts returns only one
+# full-page extract per request, revisions content comes back for a batch.
+_WIKI_PARAMS = (("action", "query"), ("prop", "revisions"), ("rvprop", "ids|content"), ("rvslots", "main"),
+                ("format", "json"), ("formatversion", 2))
+# Revision ids only, to check whether a page changed since it was last read
+_WIKI_INFO_PARAMS = (("action", "query"), ("prop", "info"), ("format", "json"), ("formatversion", 2))
+WIKI_BATCH = 50  # titles per Wiktionary API request (the API maximum)
+# Prefix of the stored page validator; bump when section parsing changes so
+# pages cached as misses by an older parser are read again
+WIKI_PARSER_VERSION = "p2"
+
+# Shared HTTP session: lookups reuse pooled keep-alive connections instead of
+# opening a new TCP+TLS connection per lemma.
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": "EstonianOriginTagger/1.0 (Educational/Research Tool)"})
+# Rate limiting (429) and transient server errors are retried with backoff,
+# honouring Retry-After; the last response is returned rather than raised.
+_RETRY = Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504),
+               allowed_methods=frozenset({"GET"}), respect_retry_after_header=True,
+               raise_on_status=False)
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=FETCH_WORKERS,
+                                       max_retries=_RETRY))
+
+@lru_cache(maxsize=None)
+def _eki_headers(api_key):
+    """Per-key request headers, built once and shared by every EKI call."""
+    return {"Authorization": f"Bearer {api_key}", "Accept": "application/json"}
 
 def init_db():
-    con = sqlite3.connect(DB_PATH)
+    # Autocommit mode: transactions are only the explicit ones in db_put_many
+    con = sqlite3.connect(DB_PATH, isolation_level=None)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("PRAGMA temp_store=MEMORY")
+    con.execute("PRAGMA cache_size=-65536")  # 64 MiB
+    con.execute("PRAGMA mmap_size=268435456")  # 256 MiB
     con.execute("""
       CREATE TABLE IF NOT EXISTS lexicon(
         lemma TEXT PRIMARY KEY,
         origin TEXT,
         source TEXT,
         evidence_text TEXT,
-        updated_at REAL
+        updated_at REAL,
+        etag TEXT
       )
     """)
-    con.commit()
+    # etag holds the response validator (Wiktionary revision id) of the last lookup
+    if "etag" not in {row[1] for row in con.execute("PRAGMA table_info(lexicon)")}:
+        con.execute("ALTER TABLE lexicon ADD COLUMN etag TEXT")
+    # Lookups rely on the lemma PRIMARY KEY index; a cache file created with
+    # another schema would silently fall back to full table scans.
+    plan = " ".join(r[-1] for r in con.execute(
+        "EXPLAIN QUERY PLAN SELECT origin FROM lexicon WHERE lemma=?", ("",)))
+    if not plan.startswith("SEARCH"):
+        print(f"Warning: {DB_PATH} has no index on lexicon.lemma; lookups will scan the table ({plan})",
+              file=sys.stderr)
     return con
 
 def db_get(con, lemma):
-    row = con.execute("SELECT origin,source,evidence_text FROM lexicon WHERE lemma=?", (lemma,)).fetchone()
-    return {"origin": row[0], "source": row[1], "evidence_text": row[2]} if row else None
-
-def db_put(con, lemma, origin, source, ev):
-    con.execute("REPLACE INTO lexicon VALUES (?,?,?,?,?)",
-                (lemma, origin, source, ev[:5000] if ev else None, time.time()))
-    con.commit()
+    return db_get_many(con, [lemma]).get(lemma)
+
+def db_get_many(con, lemmas, chunk=500):
+    """Fetch cached rows for many lemmas at once, keyed by lemma.
+
+    Unresolved rows older than NEGATIVE_TTL are left out so they get retried.
+    """
+    lemmas = list(lemmas)
+    hits = {}
+    cutoff = time.time() - NEGATIVE_TTL
+    for i in range(0, len(lemmas), chunk):
+        batch = lemmas[i:i+chunk]
+        q = ",".join("?" * len(batch))
+        for lemma, origin, source, ev in con.execute(
+                f"SELECT lemma,origin,source,substr(evidence_text,1,?) FROM lexicon WHERE lemma IN ({q})"
+                " AND (origin != ? OR updated_at >= ?)", (EVIDENCE_MAX, *batch, UNRESOLVED, cutoff)):
+            hits[lemma] = {"origin": origin, "source": source, "evidence_text": ev}
+    return hits
+
+def db_get_etags(con, lemmas, chunk=500):
+    """Stored response validators for lemmas, stale rows included: lemma -> etag."""
+    lemmas = list(lemmas)
+    etags = {}
+    for i in range(0, len(lemmas), chunk):
+        batch = lemmas[i:i+chunk]
+        q = ",".join("?" * len(batch))
+        etags.update(con.execute(
+            f"SELECT lemma,etag FROM lexicon WHERE lemma IN ({q}) AND etag IS NOT NULL", batch))
+    return etags
+
+def db_put(con, lemma, origin, source, ev, etag=None):
+    db_put_many(con, [(lemma, origin, source, ev, etag)])
+
+def db_put_many(con, rows):
+    """Write (lemma, origin, source, evidence, etag) rows in a single transaction.
+
+    Rows with origin UNRESOLVED never overwrite a real result.
+    """
+    now = time.time()
+    found, unresolved = [], []
+    for lemma, origin, source, ev, etag in rows:
+        if origin == UNRESOLVED:
+            unresolved.append((lemma, UNRESOLVED, source, None, now, etag))
+        else:
+            found.append((lemma, origin, source, ev, now, etag))
+    if not (found or unresolved):
+        return
+    # Take the write lock up front so a concurrent run waits instead of
+    # failing midway; inside a caller's open transaction, just join it
+    own = not con.in_transaction
+    if own:
+        con.execute("BEGIN IMMEDIATE")
+    try:
+        con.executemany("REPLACE INTO lexicon(lemma,origin,source,evidence_text,updated_at,etag)"
+                        " VALUES (?,?,?,?,?,?)", found)
+        con.executemany("""
+          INSERT INTO lexicon(lemma,origin,source,evidence_text,updated_at,etag) VALUES (?,?,?,?,?,?)
+          ON CONFLICT(lemma) DO UPDATE SET updated_at=excluded.updated_at, etag=excluded.etag
+          WHERE lexicon.origin = excluded.origin
+        """, unresolved)
+    except BaseException:
+        if own:
+            con.execute("ROLLBACK")
+        raise
+    if own:
+        con.execute("COMMIT")
+
+def _is_word_char(c):
+    return c.isalnum() or c == "_"
+
+def _word_bounded(text, m):
+    """True if match m is not glued to a (Unicode) word character on either side."""
+    start, end = m.span()
+    return not ((start and _is_word_char(text[start-1])) or (end < len(text) and _is_word_char(text[end])))
+
+def _lang_index(regex, text):
+    """Index of the highest-priority LANG_MAP entry matching text, or None."""
+    best = None
+    for m in regex.finditer(text):
+        if regex is not _LANG_RE_UNICODE and not _word_bounded(text, m):
+            return _lang_index(_LANG_RE_UNICODE, text)
+        i = m.lastindex - 1
+        if best is None or i < best:
+            best = i
+            if i == 0: break
+    return best
 
 def normalize_origin(raw_text):
     if not raw_text: return None
-    txt = raw_text.lower()
-    for pat, tag in LANG_MAP.items():
-        if re.search(pat, txt):
-            return tag
-    if re.search(r"\b(päris?eesti|omakeelne|algupärane)\b", txt):
-        return "native_finnic"
-    return None
+    # Plain substring search rules out most texts before the regex engine runs;
+    # the regex is still needed for word boundaries ("mittealgupärane").
+    low = raw_text.lower()
+    if not _LANG_SCREEN or any(marker in low for marker in _LANG_MARKERS):
+        best = _lang_index(_LANG_RE, raw_text)
+        if best is not None:
+            return _LANG_TAGS[best]
+    if not any(marker in low for marker in _NATIVE_MARKERS):
+        return None
+    m = _NATIVE_RE.search(raw_text)
+    if m and _ASCII_BOUNDARIES and not _word_bounded(raw_text, m):
+        m = _NATIVE_RE_UNICODE.search(raw_text)
+    return "native_finnic" if m else None
 
 def query_eki(lemma, api_key=None):
     """Query EKI/Ekilex API for etymological information."""
@@ -82,34 +331,25 @@ def query_eki(lemma, api_key=None):
 
     try:
         # Try Ekilex API endpoint
-        url = "https://ekilex.ee/api/etymology"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "User-Agent": "EstonianOriginTagger/1.0",
-            "Accept": "application/json"
-        }
+        headers = _eki_headers(api_key)
 
-        r = requests.get(url, params={"word": lemma}, headers=headers, timeout=8)
+        r = _SESSION.get(EKI_URL, params=(("word", lemma),), headers=headers, timeout=8)
 
         if r.status_code == 200:
-            data = r.json()
+            data = _json_loads(r.content)
             # Parse EKI response - structure may vary
             if data and "etymology" in data:
                 ety_text = data["etymology"]
                 norm = normalize_origin(ety_text)
                 if norm:
-                    return {"origin": norm, "evidence_text": ety_text, "source": "EKI"}
+                    return {"origin": norm, "evidence_text": ety_text[:EVIDENCE_MAX], "source": "EKI"}
 
         # Alternative: try Sõnaveeb API
-        alt_url = "https://sonaveeb.ee/api/public/v1/word-search"
-        r2 = requests.get(alt_url, params={
-            "word": lemma,
-            "datasets": "ety",
-            "lang": "est"
-        }, headers=headers, timeout=8)
+        r2 = _SESSION.get(SONAVEEB_URL, params=(("word", lemma), *_SONAVEEB_PARAMS),
+                          headers=headers, timeout=8)
 
         if r2.status_code == 200:
-            data = r2.json()
+            data = _json_loads(r2.content)
             # Parse Sõnaveeb response
             if data and isinstance(data, dict):
                 # Extract etymology information from response
@@ -119,7 +359,7 @@ def query_eki(lemma, api_key=None):
                             ety_text = word_entry["etymology"]
                             norm = normalize_origin(str(ety_text))
                             if norm:
-                                return {"origin": norm, "evidence_text": str(ety_text), "source": "EKI"}
+                                return {"origin": norm, "evidence_text": str(ety_text)[:EVIDENCE_MAX], "source": "EKI"}
 
     except Exception as e:
         # Silently fail and fallback to Wiktionary
@@ -127,81 +367,181 @@ def query_eki(lemma, api_key=None):
 
     return None
 
-def query_wiktionary(lemma):
-    try:
-        url = "https://et.wiktionary.org/w/api.php"
-        headers = {
-            "User-Agent": "EstonianOriginTagger/1.0 (Educational/Research Tool)"
-        }
-        r = requests.get(url, params={"action":"query","prop":"extracts","explaintext":1,
-                                      "titles":lemma,"format":"json"},
-                        headers=headers, timeout=8)
-        pages = r.json().get("query", {}).get("pages", {})
-        text = next(iter(pages.values())).get("extract","")
-        m = re.search(r"(?s)^Etümoloogia\s*(.+?)(?:^\w|\Z)", text, flags=re.MULTILINE)
-        if not m: return None
-        ety = m.group(1)
-        norm = normalize_origin(ety)
-        if norm:
-            return {"origin": norm, "evidence_text": ety.strip(), "source": "Wiktionary"}
-    except Exception:
-        pass
+def _template_args(m):
+    args = []
+    for arg in m.group(1).split("|"):
+        value = arg.partition("=")[2] if "=" in arg else arg  # named parameters keep their value
+        value = value.strip()
+        args.append(_WIKI_LANG_CODES.get(value.lower(), value))
+    return " ".join(args)
+
+def _wikitext_to_text(s):
+    """Drop wikitext markup: links become their label, templates their arguments
+    (language codes replaced by language names); category and interwiki links go."""
+    s = _WIKI_META_LINK_RE.sub("", s)
+    s = _WIKI_LINK_RE.sub(r"\1", s)
+    n = 1
+    while n:  # innermost templates first
+        s, n = _WIKI_TEMPLATE_RE.subn(_template_args, s)
+    return _WIKI_MARKUP_RE.sub("", s).strip()
+
+def _etymology_section(wikitext):
+    """Return the plain text of the first "Etümoloogia" section, or None."""
+    label = _ETY_LABEL_RE.search(wikitext)
+    if not label:
+        return None
+    m = _ETY_RE.match(wikitext, label.end(), label.end() + _ETY_WINDOW)
+    return _wikitext_to_text(m.group(1)) or None
+
+# _wiktionary_result value for a page whose text did not come back (a hidden
+# revision, or a page left for a continuation): neither a result nor a miss
+_NO_ANSWER = object()
+
+def _wiki_missing(page):
+    return bool(page.get("missing") or page.get("invalid"))
+
+def _wiktionary_result(page):
+    revisions = page.get("revisions")
+    if not revisions:
+        return None if _wiki_missing(page) else _NO_ANSWER
+    content = (revisions[0].get("slots") or {}).get("main", {}).get("content")
+    if content is None:
+        return _NO_ANSWER
+    ety = _etymology_section(content)
+    norm = normalize_origin(ety)
+    if norm:
+        return {"origin": norm, "evidence_text": ety[:EVIDENCE_MAX], "source": "Wiktionary"}
     return None
 
-def generate_html(results, original_text, output_path):
-    """Generate a beautiful HTML visualization of the etymology analysis."""
+def _wiktionary_pages(params, batch):
+    """Run one titles query: lemma -> page, for the lemmas the response covers."""
+    r = _SESSION.get(WIKTIONARY_URL, params=(*params, ("titles", "|".join(batch))), timeout=8)
+    r.raise_for_status()
+    q = _json_loads(r.content).get("query", {})
+    titles = {n["from"]: n["to"] for n in q.get("normalized", ())}
+    pages = {page.get("title"): page for page in q.get("pages", ())}
+    return {lemma: pages[titles.get(lemma, lemma)] for lemma in batch if titles.get(lemma, lemma) in pages}
+
+def _wiki_validator(page):
+    """Parser version and revision id of a page (0 if it does not exist), or None."""
+    revisions = page.get("revisions")
+    if _wiki_missing(page):
+        revid = 0
+    elif revisions:
+        revid = revisions[0].get("revid")
+    else:
+        revid = page.get("lastrevid")
+    return None if revid is None else f"{WIKI_PARSER_VERSION}:{revid}"
+
+def query_wiktionary_many(lemmas, etags=None):
+    """Look lemmas up WIKI_BATCH titles per request: lemma -> result, or None.
+
+    Lemmas whose request failed are left out; ``etags``, if given, gets each answered page's validator.
+    """
+    lemmas = [lemma for lemma in lemmas if "|" not in lemma]  # "|" separates titles
+    out = {}
+    for i in range(0, len(lemmas), WIKI_BATCH):
+        try:
+            pages = _wiktionary_pages(_WIKI_PARAMS, lemmas[i:i+WIKI_BATCH])
+        except Exception:
+            continue
+        for lemma, page in pages.items():
+            # One malformed page must not cost the rest of the batch
+            try:
+                result = _wiktionary_result(page)
+                validator = _wiki_validator(page)
+            except Exception:
+                continue
+            if result is _NO_ANSWER:
+                continue
+            out[lemma] = result
+            if etags is not None:
+                etags[lemma] = validator
+    return out
+
+def wiktionary_unchanged(etags):
+    """Lemmas whose Wiktionary page still has the validator in ``etags``; failed requests count as changed."""
+    lemmas = [lemma for lemma in etags if "|" not in lemma]
+    same = set()
+    for i in range(0, len(lemmas), WIKI_BATCH):
+        try:
+            pages = _wiktionary_pages(_WIKI_INFO_PARAMS, lemmas[i:i+WIKI_BATCH])
+        except Exception:
+            continue
+        for lemma, page in pages.items():
+            try:
+                if _wiki_validator(page) == etags[lemma]:
+                    same.add(lemma)
+            except Exception:
+                pass
+    return same
 
-    # Color scheme for different origins
-    colors = {
-        "native_finnic": "#4CAF50",      # Green
-        "loan:german": "#FF9800",        # Orange
-        "loan:low_german": "#FF9800",    # Orange
-        "loan:swedish": "#2196F3",       # Blue
-        "loan:russian": "#F44336",       # Red
-        "loan:latin": "#9C27B0",         # Purple
-        "loan:french": "#E91E63",        # Pink
-        "loan:english": "#00BCD4",       # Cyan
-        "loan:latvian": "#FFEB3B",       # Yellow
-        "loan:lithuanian": "#FFEB3B",    # Yellow
-        "loan:baltic": "#FFEB3B",        # Yellow
-        "loan:finnish": "#4CAF50",       # Light Green
-        "unknown": "#9E9E9E",            # Gray
-    }
-
-    html = f"""<!DOCTYPE html>
+def query_wiktionary(lemma):
+    return query_wiktionary_many([lemma]).get(lemma)
+
+# Color scheme for different origins
+_ORIGIN_COLORS = {
+    "native_finnic": "#4CAF50",      # Green
+    "loan:german": "#FF9800",        # Orange
+    "loan:low_german": "#FF9800",    # Orange
+    "loan:swedish": "#2196F3",       # Blue
+    "loan:russian": "#F44336",       # Red
+    "loan:latin": "#9C27B0",         # Purple
+    "loan:french": "#E91E63",        # Pink
+    "loan:english": "#00BCD4",       # Cyan
+    "loan:latvian": "#FFEB3B",       # Yellow
+    "loan:lithuanian": "#FFEB3B",    # Yellow
+    "loan:baltic": "#FFEB3B",        # Yellow
+    "loan:finnish": "#4CAF50",       # Light Green
+    "unknown": "#9E9E9E",            # Gray
+    "non-word": "#BDBDBD",           # Light Gray
+}
+
+def _origin_class(origin):
+    return "o-" + origin.replace(":", "-").replace(".", "-")
+
+# Each origin's colour is one CSS rule in the page head; words and legend
+# entries only carry the class. Origins without a colour share o-unknown.
+_ORIGIN_CLASSES = {origin: _origin_class(origin) for origin in _ORIGIN_COLORS}
+_ORIGIN_CSS = "".join(f"        .{_ORIGIN_CLASSES[origin]} {{ background-color: {color}; }}\n"
+                      for origin, color in _ORIGIN_COLORS.items())
+
+# Static parts of the HTML page; generate_html writes the dynamic fragments
+# between them straight to the output file.
+_HTML_HEAD = """<!DOCTYPE html>
 <html lang="et">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Estonian Etymology Visualization</title>
     <style>
-        body {{
+        body {
             font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
             max-width: 1200px;
             margin: 40px auto;
             padding: 20px;
             background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
             min-height: 100vh;
-        }}
-        .container {{
+        }
+        .container {
             background: white;
             border-radius: 15px;
             padding: 40px;
             box-shadow: 0 10px 40px rgba(0,0,0,0.2);
-        }}
-        h1 {{
+        }
+        h1 {
             color: #333;
             text-align: center;
             margin-bottom: 10px;
             font-size: 2.5em;
-        }}
-        .subtitle {{
+        }
+        .subtitle {
             text-align: center;
             color: #666;
             margin-bottom: 40px;
             font-size: 1.1em;
-        }}
-        .text-display {{
+        }
+        .text-display {
             background: #f8f9fa;
             padding: 30px;
             border-radius: 10px;
@@ -209,8 +549,8 @@ def generate_html(results, original_text, output_path):
             font-size: 1.3em;
             margin-bottom: 40px;
             border: 2px solid #e9ecef;
-        }}
-        .word {{
+        }
+        .word {
             display: inline-block;
             padding: 5px 10px;
             margin: 3px;
@@ -220,12 +560,12 @@ def generate_html(results, original_text, output_path):
             color: white;
             font-weight: 500;
             position: relative;
-        }}
-        .word:hover {{
+        }
+        .word:hover {
             transform: translateY(-2px);
             box-shadow: 0 4px 8px rgba(0,0,0,0.2);
-        }}
-        .tooltip {{
+        }
+        .tooltip {
             visibility: hidden;
             background-color: #333;
             color: white;
@@ -243,59 +583,59 @@ def generate_html(results, original_text, output_path):
             font-size: 0.7em;
             min-width: 250px;
             box-shadow: 0 4px 12px rgba(0,0,0,0.3);
-        }}
-        .word:hover .tooltip {{
+        }
+        .word:hover .tooltip {
             visibility: visible;
             opacity: 1;
-        }}
-        .legend {{
+        }
+        .legend {
             display: grid;
             grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
             gap: 15px;
             margin-top: 40px;
             padding-top: 30px;
             border-top: 2px solid #e9ecef;
-        }}
-        .legend-item {{
+        }
+        .legend-item {
             display: flex;
             align-items: center;
             gap: 10px;
             padding: 10px;
             background: #f8f9fa;
             border-radius: 6px;
-        }}
-        .legend-color {{
+        }
+        .legend-color {
             width: 30px;
             height: 30px;
             border-radius: 5px;
             box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-        }}
-        .legend-label {{
+        }
+        .legend-label {
             font-weight: 500;
             color: #333;
-        }}
-        .stats {{
+        }
+        .stats {
             background: #f8f9fa;
             padding: 20px;
             border-radius: 10px;
             margin-bottom: 30px;
             border: 2px solid #e9ecef;
-        }}
-        .stats h2 {{
+        }
+        .stats h2 {
             margin-top: 0;
             color: #333;
             font-size: 1.5em;
-        }}
-        .stat-item {{
+        }
+        .stat-item {
             display: inline-block;
             margin: 10px 20px 10px 0;
             font-size: 1.1em;
-        }}
-        .stat-value {{
+        }
+        .stat-value {
             font-weight: bold;
             color: #667eea;
-        }}
-    </style>
+        }
+""" + _ORIGIN_CSS + """    </style>
 </head>
 <body>
     <div class="container">
@@ -306,120 +646,291 @@ def generate_html(results, original_text, output_path):
             <h2>Statistics</h2>
 """
 
-    # Calculate statistics
-    origin_counts = {}
-    for result in results:
-        origin = result['origin']
-        origin_counts[origin] = origin_counts.get(origin, 0) + 1
-
-    total_words = len(results)
-    html += f'            <div class="stat-item">Total words: <span class="stat-value">{total_words}</span></div>\n'
-
-    for origin, count in sorted(origin_counts.items(), key=lambda x: x[1], reverse=True):
-        percentage = (count / total_words * 100) if total_words > 0 else 0
-        origin_label = origin.replace('loan:', '').replace('_', ' ').title()
-        html += f'            <div class="stat-item">{origin_label}: <span class="stat-value">{count}</span> ({percentage:.1f}%)</div>\n'
-
-    html += """        </div>
+_HTML_TEXT_OPEN = """        </div>
 
         <div class="text-display">
 """
 
-    # Add each word with tooltip
-    for result in results:
-        token = result['token']
-        origin = result['origin']
-        lemma = result['lemma']
-        pos = result.get('pos', 'unknown')
-        confidence = result['confidence']
-        evidence_text = result['evidence'].get('text', 'No evidence available')
-        source = result['evidence'].get('source', 'unknown')
+_HTML_LEGEND_OPEN = """        </div>
+
+        <div class="legend">
+"""
 
-        color = colors.get(origin, '#9E9E9E')
+_HTML_FOOTER = """        </div>
+    </div>
+</body>
+</html>
+"""
 
-        pos_full = {
-            'S': 'noun', 'V': 'verb', 'A': 'adjective', 'D': 'adverb',
-            'P': 'pronoun', 'K': 'adposition', 'J': 'conjunction',
-            'I': 'interjection', 'N': 'numeral'
-        }.get(pos, pos or 'unknown')
+_POS_FULL = {
+    'S': 'noun', 'V': 'verb', 'A': 'adjective', 'D': 'adverb',
+    'P': 'pronoun', 'K': 'adposition', 'J': 'conjunction',
+    'I': 'interjection', 'N': 'numeral'
+}
 
-        origin_display = origin.replace('loan:', 'Loanword: ').replace('_', ' ').title()
+# Text from the input or the APIs is escaped with one C-level pass per value
+_HTML_ESC = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"})
 
-        html += f'''            <span class="word" style="background-color: {color};">
-                {token}
+_WORD_TMPL = """            <span class="word %s">
+                %s
                 <span class="tooltip">
-                    <strong>{token}</strong> → {lemma}<br>
-                    Origin: {origin_display}<br>
-                    POS: {pos_full}<br>
-                    Confidence: {confidence}<br>
-                    Source: {source}<br>
-                    Evidence: {evidence_text[:100] if evidence_text else 'N/A'}
+                    <strong>%s</strong> → %s<br>
+                    Origin: %s<br>
+                    POS: %s<br>
+                    Confidence: %s<br>
+                    Source: %s<br>
+                    Evidence: %s
                 </span>
             </span>
-'''
-
-    html += """        </div>
-
-        <div class="legend">
 """
 
-    # Add legend for all origins present in the text
-    unique_origins = sorted(set(r['origin'] for r in results))
-    for origin in unique_origins:
-        color = colors.get(origin, '#9E9E9E')
-        origin_label = origin.replace('loan:', '').replace('_', ' ').title()
-        html += f'''            <div class="legend-item">
-                <div class="legend-color" style="background-color: {color};"></div>
-                <div class="legend-label">{origin_label}</div>
+_LEGEND_TMPL = """            <div class="legend-item">
+                <div class="legend-color %s"></div>
+                <div class="legend-label">%s</div>
             </div>
-'''
-
-    html += """        </div>
-    </div>
-</body>
-</html>
 """
 
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(html)
+def generate_html(results, original_text, output_path):
+    """Generate a beautiful HTML visualization of the etymology analysis."""
 
-def analyze_text(txt, offline=False, allow_compounds=True, min_conf=0.0, api_key=None):
-    con = init_db()
-    doc = Text(txt); doc.tag_layer(['morph_analysis'])
-    out = []
-
-    for t in doc.words:
-        token = t.text
-        # Access morphological analysis correctly
-        if hasattr(t, 'morph_analysis') and len(t.morph_analysis.annotations) > 0:
-            first_analysis = t.morph_analysis.annotations[0]
-            lemma = first_analysis['lemma'].lower()
-            pos = first_analysis.get('partofspeech')
-        else:
-            lemma = token.lower()
-            pos = None
+    with open(output_path, 'w', encoding='utf-8') as f:
+        w = f.write
+        w(_HTML_HEAD)
+
+        # One pass renders the words and counts origins; the stats that
+        # precede the words in the page are written once it is done
+        origin_counts = Counter()
+        word_frags = []
+        displays = {}
+        for result in results:
+            token = result.token
+            origin = result.origin
+            lemma = result.lemma
+            pos = result.pos
+            confidence = result.confidence
+            evidence_text = result.evidence_text
+            source = result.source
+            origin_counts[origin] += 1
+
+            cls = _ORIGIN_CLASSES.get(origin, 'o-unknown')
+            pos_full = _POS_FULL.get(pos, pos or 'unknown')
+            origin_display = displays.get(origin)
+            if origin_display is None:
+                origin_display = displays[origin] = origin.replace('loan:', 'Loanword: ').replace('_', ' ').title()
+
+            token = token.translate(_HTML_ESC)
+            word_frags.append(_WORD_TMPL % (cls, token, token, lemma.translate(_HTML_ESC),
+                                            origin_display, pos_full, confidence, source,
+                                            evidence_text.translate(_HTML_ESC) if evidence_text else 'N/A'))
+
+        total_words = len(word_frags)
+        w(f'            <div class="stat-item">Total words: <span class="stat-value">{total_words}</span></div>\n')
+
+        for origin, count in sorted(origin_counts.items(), key=lambda x: x[1], reverse=True):
+            percentage = (count / total_words * 100) if total_words > 0 else 0
+            origin_label = origin.replace('loan:', '').replace('_', ' ').title()
+            w(f'            <div class="stat-item">{origin_label}: <span class="stat-value">{count}</span> ({percentage:.1f}%)</div>\n')
+
+        w(_HTML_TEXT_OPEN)
+        f.writelines(word_frags)
+        w(_HTML_LEGEND_OPEN)
+
+        # Add legend for all origins present in the text
+        for origin in sorted(origin_counts):
+            origin_label = origin.replace('loan:', '').replace('_', ' ').title()
+            w(_LEGEND_TMPL % (_ORIGIN_CLASSES.get(origin, 'o-unknown'), origin_label))
+
+        w(_HTML_FOOTER)
+
+def _paragraph_chunks(txt, n):
+    """Split txt at blank lines into at most about 4*n pieces of similar size."""
+    paragraphs = re.split(r"\n\s*\n", txt)
+    size = len(txt) // (4 * n) + 1
+    chunks, cur, cur_len = [], [], 0
+    for para in paragraphs:
+        cur.append(para); cur_len += len(para)
+        if cur_len >= size:
+            chunks.append("\n\n".join(cur)); cur, cur_len = [], 0
+    if cur:
+        chunks.append("\n\n".join(cur))
+    return chunks
+
+def _morph_tokens(txt):
+    """(token, lemma, pos) for every word of txt; runs in pool workers too."""
+    # Only the first analysis' lemma and POS are used, so call Vabamorf
+    # directly per sentence and skip building the morph_analysis layer
+    doc = Text(txt); doc.tag_layer(['sentences'])
+    morf = Vabamorf.instance()
+    tokens = []
+    for sentence in doc.sentences:
+        words = [span.text for span in sentence]
+        for token, w in zip(words, morf.analyze(words=words, disambiguate=True,
+                                                 guess=True, propername=True)):
+            anns = w['analysis']
+            if anns:
+                a = anns[0]
+                lemma = a['lemma']
+                pos = a.get('partofspeech')
+            else:
+                lemma = token
+                pos = None
+            # Vabamorf lemmas are nearly always lower case already; skip the copy then
+            if not lemma.islower():
+                lemma = lemma.lower()
+            tokens.append((token, lemma, pos))
+    return tokens
+
+def _cached_tokens(data):
+    """The token list stored in a morph cache file, or None if it has any other shape."""
+    rows = _json_loads(data)
+    if isinstance(rows, list) and all(isinstance(row, list) and len(row) == 3
+                                      and all(v is None or isinstance(v, str) for v in row) for row in rows):
+        return [tuple(row) for row in rows]
+    return None
 
-        hit = db_get(con, lemma)
-        if hit:
-            origin, source, ev, conf = hit["origin"], hit["source"], hit["evidence_text"], 0.9
-        else:
-            origin=source=ev=None; conf=0.0
-            if not offline:
-                r = query_eki(lemma, api_key) or query_wiktionary(lemma)
+def tokenize(txt):
+    """Run Vabamorf morphology and return a (token, lemma, pos) list in text order.
+
+    Results are cached next to the lexicon cache by the text's SHA-1 (ORIGIN_TAG_NO_MORPH_CACHE=1 bypasses).
+    """
+    cache_path = None
+    if os.environ.get("ORIGIN_TAG_NO_MORPH_CACHE") != "1":
+        key = hashlib.sha1(txt.encode("utf-8")).hexdigest()
+        cache_path = DB_PATH.with_suffix(f".morph.{MORPH_CACHE_VERSION}.{key}.json")
+        try:
+            with open(cache_path, "rb") as f:
+                tokens = _cached_tokens(f.read())
+            if tokens is not None:
+                return tokens
+        except Exception:
+            pass  # missing, damaged or incompatible: tag again
+
+    big = MORPH_WORKERS > 1 and len(txt) >= MORPH_PARALLEL_MIN
+    chunks = _paragraph_chunks(txt, MORPH_WORKERS) if big else [txt]
+    if len(chunks) > 1:
+        # Morphology is CPU-bound; paragraphs never share a sentence, so
+        # they can be tagged in separate processes and joined in order
+        with ProcessPoolExecutor(max_workers=MORPH_WORKERS) as ex:
+            tokens = [t for part in ex.map(_morph_tokens, chunks) for t in part]
+    else:
+        tokens = _morph_tokens(txt)
+
+    if cache_path is not None:
+        # The tokens are already computed; failing to cache them (read-only
+        # directory, full disk) only costs the next run a re-tag
+        tmp = cache_path.with_name(cache_path.name + ".tmp")
+        try:
+            with open(tmp, "wb") as f:
+                f.write(_json_bytes(tokens))
+            tmp.replace(cache_path)
+        except Exception:
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+    return tokens
+
+def fetch_all(lemmas, api_key=None, etags=None):
+    """Look up many lemmas concurrently: lemma -> result, or None if no source has it.
+
+    Failed lookups are left out; lemmas whose ``etags`` validator is unchanged are answered None unfetched.
+    """
+    lemmas = list(lemmas)
+    found = {}
+    if not lemmas:
+        return found
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as ex:
+        if api_key:
+            for lemma, r in zip(lemmas, ex.map(query_eki, lemmas, [api_key] * len(lemmas))):
                 if r:
-                    origin, ev, source, conf = r["origin"], r["evidence_text"], r["source"], 0.9 if source=="EKI" else 0.6
-                    db_put(con, lemma, origin, source, ev)
-            if not origin:
-                origin, source, ev, conf = "unknown", "none", None, 0.2
+                    found[lemma] = r
+        rest = [lemma for lemma in lemmas if lemma not in found]
+        if etags:
+            stale = {lemma: etags[lemma] for lemma in rest if lemma in etags}
+            if stale:
+                for lemma in wiktionary_unchanged(stale):
+                    found[lemma] = None
+                rest = [lemma for lemma in rest if lemma not in found]
+        batches = [rest[i:i+WIKI_BATCH] for i in range(0, len(rest), WIKI_BATCH)]
+        for answers in ex.map(query_wiktionary_many, batches, [etags] * len(batches)):
+            found.update(answers)
+    return found
+
+def resolve_lemmas(con, lemmas, offline=False, api_key=None):
+    """Resolve each distinct lemma once: lemma -> (origin, source, evidence, confidence).
+
+    Cached rows come from one batched SELECT; the rest are looked up
+    concurrently and written back in a single transaction.
+    """
+    lemmas = set(lemmas)
+    cache = db_get_many(con, lemmas)
+    resolved = {}
+    for lemma, hit in cache.items():
+        if hit["origin"] != UNRESOLVED:
+            resolved[lemma] = (hit["origin"], hit["source"], hit["evidence_text"], 0.9)
+
+    missing = [lemma for lemma in lemmas if lemma not in cache]
+    if missing and not offline:
+        etags = db_get_etags(con, missing)
+        fetched = fetch_all(missing, api_key, etags)
+        hits = {lemma: r for lemma, r in fetched.items() if r}
+        for lemma, r in hits.items():
+            resolved[lemma] = (r["origin"], r["source"], r["evidence_text"], 0.9 if r["source"]=="EKI" else 0.6)
+        # Only definite misses are cached as unresolved; failed lookups are retried next run
+        misses = [lemma for lemma, r in fetched.items() if not r]
+        db_put_many(con, [(lemma, r["origin"], r["source"], r["evidence_text"],
+                           etags.get(lemma) if r["source"] == "Wiktionary" else None)
+                          for lemma, r in hits.items()]
+                         + [(lemma, UNRESOLVED, "none", None, etags.get(lemma)) for lemma in misses])
+    return resolved
+
+@dataclass(slots=True)
+class TokenResult:
+    """One tagged token. Slotted, since large texts produce one per word."""
+    token: str
+    lemma: str
+    pos: str | None
+    origin: str
+    confidence: float
+    source: str
+    evidence_text: str | None
+
+    def as_dict(self):
+        """The JSONL row for this token."""
+        return {
+            "token": self.token, "lemma": self.lemma, "pos": self.pos,
+            "origin": self.origin, "confidence": self.confidence,
+            "evidence": {"source": self.source, "text": self.evidence_text},
+            "components": []
+        }
 
+def analyze_text(txt, offline=False, allow_compounds=True, min_conf=0.0, api_key=None):
+    """Yield one TokenResult per token, in text order."""
+    con = init_db()
+    tokens = tokenize(txt)
+    lemmas = {lemma for _, lemma, _ in tokens}
+    # Vabamorf tags punctuation Z; anything else matching _SKIP_RE is a number or stray character
+    words = {lemma for _, lemma, pos in tokens if pos != 'Z' and not _SKIP_RE.fullmatch(lemma)}
+    builtin = words & _STOPWORDS.keys()
+    # DB and network work scale with the number of distinct lemmas, not tokens
+    resolved = resolve_lemmas(con, words - builtin, offline=offline, api_key=api_key)
+    for lemma in builtin:
+        resolved[lemma] = (_STOPWORDS[lemma], "builtin", None, 1.0)
+
+    # Output fields and the confidence filter are computed once per lemma,
+    # leaving only the row object itself to build per token
+    unknown = ("unknown", "none", None, 0.2)
+    non_word = ("non-word", "none", None, 0.0)
+    fields = {}
+    for lemma in lemmas:
+        origin, source, ev, conf = resolved.get(lemma, unknown) if lemma in words else non_word
         if conf >= min_conf:
-            out.append({
-                "token": token, "lemma": lemma, "pos": pos,
-                "origin": origin, "confidence": round(conf,2),
-                "evidence": {"source": source, "text": ev},
-                "components": []
-            })
-    return out
+            fields[lemma] = (origin, round(conf,2), source, ev)
+
+    for token, lemma, pos in tokens:
+        f = fields.get(lemma)
+        if f:
+            yield TokenResult(token, lemma, pos, *f)
 
 def main():
     ap = argparse.ArgumentParser()
@@ -441,16 +952,22 @@ def main():
                            min_conf=args.min_conf,
                            api_key=api_key)
 
-    # Write JSONL output
-    with open(args.outp, "w", encoding="utf-8") as f:
+    # Stream JSONL output; rows are only kept in memory when HTML needs them
+    kept = [] if args.html_out else None
+    count = 0
+    with open(args.outp, "wb") as f:
         for row in results:
-            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            f.write(_json_bytes(row.as_dict()))
+            f.write(b"\n")
+            count += 1
+            if kept is not None:
+                kept.append(row)
 
-    print(f"Tagged {len(results)} tokens. Attribution: EKI/Wiktionary where applicable.")
+    print(f"Tagged {count} tokens. Attribution: EKI/Wiktionary where applicable.")
 
     # Generate HTML visualization if requested
     if args.html_out:
-        generate_html(results, text, args.html_out)
+        generate_html(kept, text, args.html_out)
         print(f"HTML visualization saved to: {args.html_out}")
 
 if __name__ == "__main__":
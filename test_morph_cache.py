@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""The morph cache never breaks tokenize (python -m pytest test_morph_cache.py)."""
+import origin_tag
+
+TOKENS = [("ma", "mina", "P"), ("käisin", "käima", "V")]
+
+
+def fake_morph(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setattr(origin_tag, "_morph_tokens", lambda txt: calls.append(txt) or list(TOKENS))
+    monkeypatch.setattr(origin_tag, "DB_PATH", tmp_path / "cache.sqlite3")
+    monkeypatch.delenv("ORIGIN_TAG_NO_MORPH_CACHE", raising=False)
+    return calls
+
+
+def test_damaged_cache_is_retagged(monkeypatch, tmp_path):
+    calls = fake_morph(monkeypatch, tmp_path)
+    assert origin_tag.tokenize("ma käisin") == TOKENS
+    (cache,) = tmp_path.glob("*.json")
+    assert origin_tag.MORPH_CACHE_VERSION in cache.name
+    assert origin_tag.tokenize("ma käisin") == TOKENS and len(calls) == 1
+    # Valid JSON of the wrong shape is as useless as garbage
+    for n, damage in enumerate([b"garbage", b'{"ma": "mina"}', b'[["ma", "mina"]]', b'[["ma", 1, "P"]]'], 2):
+        cache.write_bytes(damage)
+        assert origin_tag.tokenize("ma käisin") == TOKENS and len(calls) == n
+
+
+def test_unwritable_cache_is_not_fatal(monkeypatch, tmp_path):
+    fake_morph(monkeypatch, tmp_path)
+    monkeypatch.setattr(origin_tag, "DB_PATH", tmp_path / "missing-dir" / "cache.sqlite3")
+    assert origin_tag.tokenize("ma käisin") == TOKENS
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""normalize_origin agrees across regex engines (python -m pytest test_normalize.py)."""
+import importlib.util
+import random
+import re
+import sys
+
+import pytest
+
+import origin_tag
+
+
+def load_stdlib_copy():
+    """A second copy of origin_tag that cannot import re2."""
+    saved = sys.modules.get("re2")
+    sys.modules["re2"] = None  # makes "import re2" raise ImportError
+    try:
+        spec = importlib.util.spec_from_file_location("origin_tag_stdlib", origin_tag.__file__)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        if saved is None:
+            del sys.modules["re2"]
+        else:
+            sys.modules["re2"] = saved
+    return module
+
+
+def reference(text):
+    """One search per LANG_MAP entry in priority order, then the native markers."""
+    if not text:
+        return None
+    for pattern, tag in origin_tag.LANG_MAP.items():
+        if re.search(pattern, text, flags=re.IGNORECASE):
+            return tag
+    if re.search(r"(?i)\b(päris?eesti|omakeelne|algupärane)\b", text):
+        return "native_finnic"
+    return None
+
+
+PIECES = ["soome", "-", "ugri", "ä", "õ", "LÄTI", "läti", "low german", "german", " ", ",", "\n",
+          "saksa", "madal", "s", "balti", "baltic", "uralic", "finnish", "vene", "sü", "rootsi",
+          "alamsaksa", "algupärane", "päris", "eesti", "omakeelne", "mitte", "x", "_", "1"]
+
+CASES = ["soome-ugriä", "finnish\nbalticäLÄTI uralicälow german, ", "süvene", "mittealgupärane",
+         "ämittealgupärane algupärane", "Laen saksa keelest", "madal-saksa", "päriseestiä pärieesti",
+         # One of each LANG_MAP alternative, so a gap in _LANG_MARKERS shows up
+         "soomeugri", "Fennougric", "uralic", "madalsaksa", "Alamsaksa", "LOW GERMAN", "Rootsi", "swedish",
+         "Russian", "ladina", "Latin", "prantsuse", "French", "inglise", "English", "latvian", "leedu",
+         "Lithuanian", "Baltic", "Finnish"]
+
+
+def samples(n=20000, seed=19):
+    rng = random.Random(seed)
+    yield from CASES
+    for _ in range(n):
+        yield "".join(rng.choice(PIECES) for _ in range(rng.randint(1, 8)))
+
+
+@pytest.mark.parametrize("engine", ["stdlib", "re2"])
+def test_engines_match_reference(engine):
+    if engine == "re2":
+        pytest.importorskip("re2")
+        module = origin_tag
+        assert module._ASCII_BOUNDARIES
+    else:
+        module = load_stdlib_copy()
+        assert not module._ASCII_BOUNDARIES
+    normalize = module.normalize_origin
+    mismatches = [(s, normalize(s), reference(s)) for s in samples() if normalize(s) != reference(s)]
+    assert mismatches[:5] == []
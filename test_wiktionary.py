@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Offline checks for the batched Wiktionary lookup (python -m pytest test_wiktionary.py)."""
+import json
+
+import origin_tag
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, body):
+        self.content = json.dumps(body).encode("utf-8")
+
+    def raise_for_status(self):
+        pass
+
+
+def serve(monkeypatch, pages):
+    """Answer every Wiktionary request with the given formatversion=2 pages."""
+    monkeypatch.setattr(origin_tag._SESSION, "get",
+                        lambda *a, **k: FakeResponse({"batchcomplete": True, "query": {"pages": pages}}))
+
+
+def page(title, content, revid=1):
+    return {"title": title, "lastrevid": revid,
+            "revisions": [{"revid": revid, "slots": {"main": {"content": content}}}]}
+
+
+# Page wikitext in et.wiktionary's markup: language and part-of-speech
+# headings, inflection template, definitions, then the etymology either as
+# a heading section or as a bold label, with language codes inside templates.
+PEEGEL = """=={{-et-}}==
+==={{-nimisõna-}}===
+{{et-nimisõna|peegel|peegli|peeglit|peeglisse|12}}
+'''peegel''' (''peegli, peeglit'')
+# [[sile]] [[pind]], mis [[peegeldama|peegeldab]] [[valgus]]t
+#: ''Ta vaatas end peeglist.''
+
+====Etümoloogia====
+Laen {{etyl|gml|et}} ''spēgel'' või {{etyl|de|et}} ''[[Spiegel]]'' kaudu.
+
+====Tõlked====
+{{tõlked-algus}}
+* inglise: {{t|en|mirror}}
+{{tõlked-lõpp}}
+
+[[Kategooria:Eesti nimisõnad]]
+"""
+
+KAIMA = """=={{-et-}}==
+==={{-tegusõna-}}===
+{{et-tegusõna|käima|käia|käib|käidud|28}}
+'''käima''' (''käia, käib'')
+# [[liikuma]] [[jalg]]adel
+#: ''Ma käisin lasteaias.''
+
+'''Etümoloogia''': {{päritolu|fiu}} tüvi, vrd {{m|fi|käydä}}, {{m|krl|kävvä}}.
+
+[[Kategooria:Eesti tegusõnad]]
+"""
+
+TOOL = """=={{-et-}}==
+==={{-nimisõna-}}===
+'''tool''' (''tooli, tooli'')
+# [[istumine|istumiseks]] [[mööbliese]]
+"""
+
+
+def test_hidden_revision_is_no_answer(monkeypatch):
+    serve(monkeypatch, [
+        {"title": "peits", "revisions": [{"revid": 3, "slots": {"main": {"texthidden": True}}}]},
+        {"title": "foo", "missing": True},
+        {"title": "bar", "revisions": ["not a revision"]},
+        {"title": "jätk", "lastrevid": 5},  # revisions held back for a continuation
+        page("peegel", "==Etümoloogia==\nLaen saksa keelest.\n"),
+    ])
+    etags = {}
+    found = origin_tag.fetch_all(["peits", "foo", "bar", "jätk", "peegel"], etags=etags)
+    # Hidden text, held-back and malformed pages are retried later, not cached as misses
+    assert "peits" not in found and "bar" not in found and "jätk" not in found
+    assert found["foo"] is None
+    assert found["peegel"]["origin"] == "loan:german"
+    v = origin_tag.WIKI_PARSER_VERSION
+    assert etags == {"foo": f"{v}:0", "peegel": f"{v}:1"}
+
+
+def test_real_layouts_are_tagged(monkeypatch):
+    serve(monkeypatch, [page("peegel", PEEGEL, 11), page("käima", KAIMA, 12), page("tool", TOOL, 13)])
+    etags = {}
+    found = origin_tag.query_wiktionary_many(["peegel", "käima", "tool"], etags)
+    assert found["peegel"]["origin"] == "loan:low_german"
+    assert found["peegel"]["evidence_text"].startswith("Laen etyl alamsaksa et spēgel")
+    assert found["käima"]["origin"] == "native_finnic"
+    assert "Kategooria" not in found["käima"]["evidence_text"]
+    # No etymology section on the page: a miss, tied to this parser version
+    assert found["tool"] is None
+    assert etags["tool"] == f"{origin_tag.WIKI_PARSER_VERSION}:13"
+
+
+def test_section_labels():
+    section = origin_tag._etymology_section
+    assert section("==Etümoloogia==\nLaen {{laen|sv|stol}}.\n==Tõlked==\nx") == "Laen laen rootsi stol."
+    assert section(";Etümoloogia: {{etyl|ru|et}} ''kapusta''\n;Tõlked\nx") == "etyl vene et kapusta"
+    assert section("{{-etümoloogia-}}\nVrd {{m|lv|vārds}}.") == "Vrd m läti vārds."
+    assert section("Vaata ka: etümoloogia\n") is None
+    assert section("==Etümoloogia==\n") is None
+    # Categories and interwiki links are not part of the section
+    assert section("==Etümoloogia==\nVäga vana sõna.\n\n[[Kategooria:Vene päritolu sõnad]]") == "Väga vana sõna."
+    assert section("==Etümoloogia==\nVäga vana sõna.\n[[fi:sana]]") == "Väga vana sõna."
+    assert section("==Etümoloogia==\nVäga [[Kategooria:Vana]]vana sõna.") == "Väga vana sõna."
+
+
+def test_older_parser_misses_are_refetched(monkeypatch):
+    serve(monkeypatch, [{"title": "tool", "lastrevid": 13}])
+    v = origin_tag.WIKI_PARSER_VERSION
+    assert origin_tag.wiktionary_unchanged({"tool": f"{v}:13"}) == {"tool"}
+    assert origin_tag.wiktionary_unchanged({"tool": "13"}) == set()